@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ChatBot.settings')
 
 application = get_asgi_application()
+
+# Connect to Gemini in the background so the first chat turn skips the handshake
+from chat.views import warm_gemini_connection  # noqa: E402
+
+warm_gemini_connection()
@@ -1,3 +1,158 @@
-from django.test import TestCase
+import base64
+import hashlib
+import io
+import json
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import caches
+from django.core.files.storage import InMemoryStorage
+from django.test import Client, SimpleTestCase, TestCase
+from django.urls import reverse
+
+import google.generativeai as genai
+from google.generativeai import protos
+from PIL import Image
+
+from chat import views
+
+
+class Base64SizePrecheckTests(SimpleTestCase):
+    def test_decoded_length_matches_actual_decode(self):
+        for size in range(0, 20):
+            encoded = base64.b64encode(b"x" * size).decode()
+            self.assertEqual(views._decoded_base64_length(encoded), size)
+
+    @mock.patch.object(views, "MAX_UPLOAD_SIZE", 30)
+    @mock.patch.object(views, "model", mock.Mock())
+    def test_oversized_payload_rejected_before_decoding(self):
+        payload = {'image': base64.b64encode(b"x" * 40).decode()}
+        with mock.patch.object(views, "_b64decode") as b64decode:
+            response = self.client.post(reverse('chat:send'), data=json.dumps(payload), content_type='application/json')
+        self.assertEqual(response.status_code, 413)
+        b64decode.assert_not_called()
+
+
+class SniffImageTests(SimpleTestCase):
+    def test_known_signatures(self):
+        self.assertEqual(views._sniff_image(b"\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01"), "image/jpeg")
+        self.assertEqual(views._sniff_image(b"\x89PNG\r\n\x1a\n\x00\x00\x00\r"), "image/png")
+        self.assertEqual(views._sniff_image(b"RIFF\x24\x00\x00\x00WEBP"), "image/webp")
+        self.assertEqual(views._sniff_image(b"GIF89a\x01\x00\x01\x00\x00\x00"), "image/gif")
+
+    def test_unknown_signature(self):
+        self.assertIsNone(views._sniff_image(b"RIFF\x24\x00\x00\x00WAVE"))
+        self.assertIsNone(views._sniff_image(b"%PDF-1.7\n%\xe2\xe3"))
+        self.assertIsNone(views._sniff_image(b""))
+
+
+class SaveImageTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(views, "default_storage", InMemoryStorage())
+        self.storage = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_path_is_sharded_by_content_digest(self):
+        data = b"\x89PNG\r\n\x1a\nimage-bytes"
+        digest = hashlib.sha256(data).hexdigest()
+        views._save_image(io.BytesIO(data), "image/png")
+        expected = f"chat_uploads/{digest[:2]}/{digest[2:4]}/{digest}.png"
+        self.assertTrue(self.storage.exists(expected))
+
+    def test_identical_uploads_are_stored_once(self):
+        data = b"\xff\xd8\xffsame-image"
+        first_url = views._save_image(io.BytesIO(data), "image/jpeg")
+        with mock.patch.object(self.storage, "save", wraps=self.storage.save) as save:
+            second_url = views._save_image(io.BytesIO(data), "image/jpeg")
+        self.assertEqual(first_url, second_url)
+        save.assert_not_called()
+
+    def test_different_uploads_get_different_paths(self):
+        first_url = views._save_image(io.BytesIO(b"\xff\xd8\xffone"), "image/jpeg")
+        second_url = views._save_image(io.BytesIO(b"\xff\xd8\xfftwo"), "image/jpeg")
+        self.assertNotEqual(first_url, second_url)
+
+
+class GeminiMockMixin:
+    """Swap views.model for a real GenerativeModel whose gRPC client is mocked."""
+
+    def setUp(self):
+        super().setUp()
+        self.model = genai.GenerativeModel('gemini-2.5-flash')
+        self.model._client = mock.Mock()
+        self.model._client.generate_content.side_effect = self._fake_generate_content
+        patcher = mock.patch.object(views, "model", self.model)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        caches['default'].clear()
+        caches[views.RESPONSE_CACHE_ALIAS].clear()
+
+    def _fake_generate_content(self, request, **kwargs):
+        texts = [part.text for part in request.contents[-1].parts if part.text]
+        reply = "reply to " + (" ".join(texts) or "image")
+        return protos.GenerateContentResponse(candidates=[protos.Candidate(
+            content=protos.Content(role='model', parts=[protos.Part(text=reply)]),
+            finish_reason=protos.Candidate.FinishReason.STOP,
+        )])
+
+    def sent_texts(self, call_index=-1):
+        """All text parts of every turn sent to Gemini in one generate_content call."""
+        request = self.model._client.generate_content.call_args_list[call_index][0][0]
+        return [part.text for content in request.contents for part in content.parts if part.text]
+
+    def send(self, client, message):
+        return client.post(reverse('chat:send'), {'message': message})
+
+
+class ChatHistoryTests(GeminiMockMixin, TestCase):
+    def test_history_is_not_shared_between_sessions(self):
+        first, second = Client(), Client()
+        self.send(first, "secret from first")
+        self.send(second, "hello from second")
+        self.assertNotIn("secret from first", self.sent_texts())
+        self.assertEqual(self.sent_texts(), ["hello from second"])
+
+    @mock.patch.object(views, "MAX_HISTORY_MESSAGES", 4)
+    def test_stored_history_is_trimmed(self):
+        client = Client()
+        for i in range(3):
+            self.send(client, f"message {i}")
+        history = client.session[views.HISTORY_SESSION_KEY]
+        self.assertEqual(len(history), 4)
+        self.assertEqual(history[0], {'role': 'user', 'parts': ["message 1"]})
+
+    def test_image_only_turn_is_stored_as_placeholder(self):
+        buffer = io.BytesIO()
+        Image.new("RGB", (4, 4)).save(buffer, format="PNG")
+        buffer.seek(0)
+        buffer.name = "tiny.png"
+        client = Client()
+        with mock.patch.object(views, "default_storage", InMemoryStorage()):
+            response = client.post(reverse('chat:send'), {'image': buffer})
+        self.assertEqual(response.status_code, 200)
+        history = client.session[views.HISTORY_SESSION_KEY]
+        self.assertEqual(history[0], {'role': 'user', 'parts': [views.IMAGE_HISTORY_PLACEHOLDER]})
+        self.assertEqual(history[1]['role'], 'model')
+
+
+class ResponseCacheTests(GeminiMockMixin, TestCase):
+    def test_fresh_session_reuses_cached_reply(self):
+        first, second = Client(), Client()
+        first_response = self.send(first, "same question")
+        second_response = self.send(second, "same question")
+        self.assertEqual(self.model._client.generate_content.call_count, 1)
+        self.assertEqual(second_response.json()['response'], first_response.json()['response'])
+
+    def test_cache_hit_stores_same_history_as_miss(self):
+        first, second = Client(), Client()
+        self.send(first, "same question")
+        self.send(second, "same question")
+        self.assertEqual(
+            second.session[views.HISTORY_SESSION_KEY],
+            first.session[views.HISTORY_SESSION_KEY],
+        )
+
+    def test_same_message_with_different_history_misses_cache(self):
+        client = Client()
+        self.send(client, "same question")
+        self.send(client, "same question")
+        self.assertEqual(self.model._client.generate_content.call_count, 2)
@@ -1,15 +1,41 @@
+import asyncio
 import base64
+import hashlib
 import json
 import io
 import logging
-from PIL import Image
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps
 
 from django.shortcuts import render
-from django.http import JsonResponse, HttpResponseBadRequest
+from django.http import HttpResponse, JsonResponse, HttpResponseBadRequest
 from django.views.decorators.http import require_POST
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.core.exceptions import RequestDataTooBig
+from django.core.cache import caches
 from django.core.files.storage import default_storage
-from django.core.files.base import ContentFile
+from django.core.files import File
+
+# Optional SIMD-accelerated base64 decoder; fall back to the stdlib if missing
+try:
+    import pybase64
+except ImportError:
+    pybase64 = None
+
+# Optional fast JSON library; orjson parses bytes directly and dumps to bytes
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    _json_loads = orjson.loads
+    _json_dumps = orjson.dumps
+else:
+    _json_loads = json.loads
+    _json_dumps = json.dumps
 
 # Fixed imports for the Gemini SDK
 import google.generativeai as genai
@@ -18,15 +44,37 @@ logger = logging.getLogger(__name__)
 
 # --- Global Initialization ---
 
-# Initialize a chat session globally (for simple chat history)
-chat_session = None
+# The model is shared process-wide; chat history is kept per user in the session
+model = None
+
+
+def _warm_gemini_connection():
+    """
+    Send a tiny count_tokens request through the model so its client and channel (the
+    ones chat turns use) are created and connected before the first chat request.
+    Failures are harmless; the first request will connect.
+    """
+    try:
+        model.count_tokens("ping")
+    except Exception as e:
+        logger.debug("Gemini connection warm-up failed: %s", e)
+
+
+def warm_gemini_connection():
+    """
+    Start the Gemini warm-up in a background thread. Called by the ASGI entry point
+    only, so management commands (check, migrate, collectstatic) make no API calls.
+    Disable with GEMINI_WARM_CONNECTION = False.
+    """
+    if model and getattr(settings, "GEMINI_WARM_CONNECTION", True):
+        threading.Thread(target=_warm_gemini_connection, daemon=True).start()
+
 
 try:
     if getattr(settings, "GEMINI_API_KEY", None):
         genai.configure(api_key=settings.GEMINI_API_KEY)
         # Use gemini-2.5-flash for fast, multimodal conversations
         model = genai.GenerativeModel('gemini-2.5-flash')
-        chat_session = model.start_chat(history=[])
         logger.info("Gemini client initialized successfully.")
     else:
         logger.warning("GEMINI_API_KEY not configured. Chat functionality will not work.")
@@ -37,25 +85,177 @@ except Exception as e:
 # --- Helper constants / functions ---
 MAX_UPLOAD_SIZE = getattr(settings, "CHAT_MAX_UPLOAD_SIZE", 5 * 1024 * 1024)  # 5 MB default
 ALLOWED_IMAGE_PREFIX = "image/"
+# Pre-serialized bodies for the common rejection responses (see _json_body_response)
+TOO_LARGE_BODY = json.dumps({'response': f'Image too large (max {MAX_UPLOAD_SIZE // (1024*1024)}MB).'}).encode()
+INVALID_FILE_TYPE_BODY = json.dumps({'response': 'Invalid file type. Only images are allowed.'}).encode()
+EMPTY_MESSAGE_BODY = json.dumps({'response': 'Please send text or an image.'}).encode()
+# Number of history messages (user + model) kept per session
+MAX_HISTORY_MESSAGES = getattr(settings, "CHAT_MAX_HISTORY_MESSAGES", 20)
+HISTORY_SESSION_KEY = "gemini_history"
+# Stored in place of image parts, which are not kept in the session history
+IMAGE_HISTORY_PLACEHOLDER = "[image]"
+# Gemini calls are blocking network round-trips; they get their own thread pool so the
+# number of in-flight chats isn't capped by the event loop's small default executor
+# (shared with image processing and storage writes). This is the per-worker ceiling.
+GEMINI_MAX_CONCURRENCY = getattr(settings, "CHAT_GEMINI_MAX_CONCURRENCY", 64)
+GEMINI_EXECUTOR = ThreadPoolExecutor(max_workers=GEMINI_MAX_CONCURRENCY, thread_name_prefix="gemini")
+# Seconds a Gemini reply stays in the response cache
+RESPONSE_CACHE_TIMEOUT = getattr(settings, "CHAT_RESPONSE_CACHE_TIMEOUT", 3600)
+# Cache alias for Gemini replies, kept apart from the session cache
+RESPONSE_CACHE_ALIAS = "gemini"
+# Gemini resizes images to about this long edge anyway, so larger pixels are wasted
+GEMINI_IMAGE_MAX_EDGE = 1024
+GEMINI_JPEG_QUALITY = 85
+# Formats Gemini accepts as-is; anything else is re-encoded to JPEG
+GEMINI_NATIVE_MIME_TYPES = {"image/jpeg", "image/png", "image/webp"}
+# Longest "data:<mime>;base64," prefix expected in front of a base64 image
+DATA_URL_HEADER_MAX_LENGTH = 64
+# File extensions for the image types accepted by _sniff_image
+IMAGE_EXTENSIONS = {"image/jpeg": ".jpg", "image/png": ".png", "image/webp": ".webp", "image/gif": ".gif"}
+
+
+def _json_body_response(body, status):
+    """Return an already-serialized JSON body without re-encoding it per request."""
+    return HttpResponse(body, status=status, content_type='application/json')
+
+
+def _json_response(data, status=200):
+    """JSON response serialized with orjson when available (JsonResponse always uses stdlib json)."""
+    return _json_body_response(_json_dumps(data), status=status)
+
+
+def _b64decode(data):
+    """
+    Decode base64 data, using pybase64's vectorized decoder when available.
+    Invalid input raises (binascii.Error / ValueError) in both cases.
+    """
+    if pybase64 is not None and hasattr(pybase64, "_pybase64_get_simd_path"):
+        return pybase64.b64decode(data, validate=False)
+    return base64.b64decode(data)
+
+
+def _decoded_base64_length(data):
+    """
+    Return the number of bytes that base64 `data` decodes to, computed from its length
+    alone (O(1), no copy of the string), so oversized payloads can be rejected up front.
+    """
+    return (len(data) * 3) // 4 - data[-2:].count('=')
+
+
+def _sniff_image(head):
+    """
+    Return the mime type for the first 12 bytes of an image file, or None if the
+    signature is not a known image format. Avoids a PIL decode just for validation.
+    """
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG"):
+        return "image/png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head.startswith(b"GIF8"):
+        return "image/gif"
+    return None
+
+
+def _prepare_image_for_gemini(file_obj, mime_type):
+    """
+    Return an inline blob dict ({'mime_type', 'data'}) accepted by the Gemini SDK.
+    Small images in a format Gemini accepts are forwarded untouched; PIL only reads
+    the header to get the size. Anything else is decoded, down-scaled to
+    GEMINI_IMAGE_MAX_EDGE on its long edge and re-encoded as JPEG.
+    """
+    file_obj.seek(0)
+    pil_image = Image.open(file_obj)
+    if mime_type in GEMINI_NATIVE_MIME_TYPES and max(pil_image.size) <= GEMINI_IMAGE_MAX_EDGE:
+        file_obj.seek(0)
+        return {'mime_type': mime_type, 'data': file_obj.read()}
+
+    # No explicit load(): thumbnail() first sets JPEG draft mode so large photos are
+    # DCT-downscaled while decoding instead of being decoded at full resolution
+    if max(pil_image.size) > GEMINI_IMAGE_MAX_EDGE:
+        pil_image.thumbnail((GEMINI_IMAGE_MAX_EDGE, GEMINI_IMAGE_MAX_EDGE), Image.Resampling.LANCZOS)
+    # The JPEG re-encode drops EXIF, so bake the orientation into the pixels. Done after
+    # thumbnail() (the bounding box is square, so the order doesn't change the result)
+    # because transposing loads the image and would defeat draft mode.
+    pil_image = ImageOps.exif_transpose(pil_image)
+    if pil_image.mode != "RGB":
+        pil_image = pil_image.convert("RGB")
+    buffer = io.BytesIO()
+    pil_image.save(buffer, format="JPEG", quality=GEMINI_JPEG_QUALITY)
+    return {'mime_type': 'image/jpeg', 'data': buffer.getvalue()}
+
+
+async def _prepare_image_blob(file_obj, mime_type):
+    """Run _prepare_image_for_gemini in a thread; resizing and JPEG encoding are CPU-bound."""
+    return await asyncio.to_thread(_prepare_image_for_gemini, file_obj, mime_type)
+
+
+def _history_entry(role, texts):
+    """
+    Build one stored history turn from its text parts. An image-only user turn has no
+    text, so it becomes IMAGE_HISTORY_PLACEHOLDER to keep user/model turns alternating.
+    """
+    if not texts and role == 'user':
+        texts = [IMAGE_HISTORY_PLACEHOLDER]
+    return {'role': role, 'parts': texts}
 
 
-def _save_uploaded_file(uploaded_file):
+def _serialize_history(history):
     """
-    Save an uploaded file to default storage under 'chat_uploads/' and return the public URL.
+    Convert a Gemini chat history into JSON-serializable dicts for the session.
+    Only text parts are kept (images would bloat the session; see _history_entry) and
+    the history is trimmed to the last MAX_HISTORY_MESSAGES entries.
     """
-    filename = uploaded_file.name
-    storage_path = f"chat_uploads/{filename}"
-    saved_path = default_storage.save(storage_path, ContentFile(uploaded_file.read()))
-    return default_storage.url(saved_path)
+    return [
+        _history_entry(content.role, [part.text for part in content.parts if getattr(part, "text", None)])
+        for content in history[-MAX_HISTORY_MESSAGES:]
+    ]
 
 
-def _open_pil_image_from_fileobj(file_obj):
+def _response_cache_key(user_message, image_data, history):
     """
-    Open a PIL Image from a file-like object (File uploaded via request.FILES).
-    The caller should ensure file_obj is at position 0 or rewound as needed.
+    Build the response cache key from the message, the image bytes sent to Gemini and
+    the conversation history (the same prompt can deserve a different reply mid-chat).
     """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(user_message.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(image_data)
+    digest.update(b'\0')
+    digest.update(json.dumps(history).encode('utf-8'))
+    return 'gemini:' + digest.hexdigest()
+
+
+def _file_sha256(file_obj):
+    """Return the SHA-256 hex digest of a file-like object, streaming it and rewinding afterwards."""
     file_obj.seek(0)
-    return Image.open(io.BytesIO(file_obj.read()))
+    if hasattr(hashlib, "file_digest"):  # Python 3.11+
+        digest = hashlib.file_digest(file_obj, "sha256")
+    else:
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: file_obj.read(64 * 1024), b""):
+            digest.update(chunk)
+    file_obj.seek(0)
+    return digest.hexdigest()
+
+
+def _save_image(file_obj, mime_type):
+    """
+    Save an image to default storage under 'chat_uploads/' and return the public URL.
+    Files are content-addressed by SHA-256 (sharded as 'ab/cd/<digest>.ext'), so
+    re-uploading an identical image reuses the stored copy instead of writing it again.
+    The file object is handed to storage directly so it is written in chunks rather
+    than read fully into memory.
+    """
+    digest = _file_sha256(file_obj)
+    extension = IMAGE_EXTENSIONS.get(mime_type, "")
+    storage_path = f"chat_uploads/{digest[:2]}/{digest[2:4]}/{digest}{extension}"
+    if not default_storage.exists(storage_path):
+        # UploadedFiles are passed through as-is so spooled temp files can simply be moved
+        content = file_obj if isinstance(file_obj, File) else File(file_obj, name=f"{digest}{extension}")
+        storage_path = default_storage.save(storage_path, content)
+    return default_storage.url(storage_path)
 
 
 # --- View Functions ---
@@ -68,7 +268,7 @@ def chat_index(request):
 
 
 @require_POST
-def chat_send(request):
+async def chat_send(request):
     """
     Handles the multimodal chat POST request.
     Accepts:
@@ -76,116 +276,154 @@ def chat_send(request):
       - OR JSON body: {'message': str, 'image': base64_str} (legacy - still supported)
 
     Returns JSON: {'response': str, 'image_url': str (optional)}
+
+    Runs as an async view: storage writes and the Gemini call are moved off the
+    event loop. Gemini calls run in GEMINI_EXECUTOR, so one ASGI worker can have up to
+    GEMINI_MAX_CONCURRENCY of them in flight.
     """
-    if not chat_session:
+    if not model:
         return JsonResponse({'response': 'AI service is unavailable due to configuration error.'}, status=503)
 
     try:
         user_message = ""
         uploaded_image = None
         image_url = None
-        pil_image = None
-
-        content_type = request.META.get('CONTENT_TYPE', '')
+        # Image as the inline blob sent to Gemini (validated before anything is saved)
+        image_blob = None
 
         # --- Case 1: multipart/form-data (preferred) ---
-        if content_type.startswith("multipart/form-data"):
+        # request.content_type is parsed once by Django (without the boundary parameter)
+        if request.content_type == "multipart/form-data":
             user_message = (request.POST.get('message') or "").strip()
             uploaded_image = request.FILES.get('image')
             if uploaded_image:
                 # Validate content type and size
                 if not uploaded_image.content_type.startswith(ALLOWED_IMAGE_PREFIX):
-                    return JsonResponse({'response': 'Invalid file type. Only images are allowed.'}, status=400)
+                    return _json_body_response(INVALID_FILE_TYPE_BODY, status=400)
                 if uploaded_image.size > MAX_UPLOAD_SIZE:
-                    return JsonResponse({'response': f'Image too large (max {MAX_UPLOAD_SIZE // (1024*1024)}MB).'}, status=400)
-
-                # Save uploaded image to storage (optional) and produce PIL image for Gemini if needed
+                    return _json_body_response(TOO_LARGE_BODY, status=413)
+                # Check the file signature rather than trusting the client's content type
+                image_mime = _sniff_image(uploaded_image.read(12))
+                uploaded_image.seek(0)
+                if not image_mime:
+                    return _json_body_response(INVALID_FILE_TYPE_BODY, status=400)
+
+                # Parse the image before persisting it so corrupt files are never saved
                 try:
-                    # If you want to persist uploaded files, save them and return the URL
-                    image_url = _save_uploaded_file(uploaded_image)
+                    image_blob = await _prepare_image_blob(uploaded_image, image_mime)
                 except Exception as e:
-                    logger.exception("Error saving uploaded image: %s", e)
-                    # Do not fail the entire request if saving fails; continue with in-memory usage if possible
+                    logger.warning("Error processing uploaded image: %s", e)
+                    return JsonResponse({'response': 'Failed to process uploaded image.'}, status=400)
 
+                # Save uploaded image to storage (optional)
                 try:
-                    # Rewind and open PIL image for passing to Gemini
-                    # Note: request.FILES[...] is an UploadedFile object; read from it returns bytes.
-                    uploaded_image.seek(0)
-                    pil_image = Image.open(io.BytesIO(uploaded_image.read()))
+                    # If you want to persist uploaded files, save them and return the URL
+                    image_url = await sync_to_async(_save_image, thread_sensitive=False)(uploaded_image, image_mime)
                 except Exception as e:
-                    logger.exception("Error opening PIL image from uploaded file: %s", e)
-                    return JsonResponse({'response': 'Failed to process uploaded image.'}, status=400)
+                    logger.error("Error saving uploaded image: %s", e)
+                    # Do not fail the entire request if saving fails; continue with in-memory usage if possible
 
         else:
             # --- Case 2: legacy JSON body (base64 image) ---
             try:
-                payload = json.loads(request.body.decode('utf-8') or "{}")
-            except json.JSONDecodeError:
+                # Both json and orjson accept bytes, so the body is not decoded to str first
+                payload = _json_loads(request.body or b"{}")
+            except RequestDataTooBig:
+                # Body exceeds DATA_UPLOAD_MAX_MEMORY_SIZE; Django refuses to read it
+                return _json_body_response(TOO_LARGE_BODY, status=413)
+            except ValueError as e:
+                # JSONDecodeError (json and orjson) and UnicodeDecodeError are ValueErrors
+                logger.warning("Invalid JSON body: %s", e)
                 return JsonResponse({'response': 'Invalid JSON format.'}, status=400)
 
             user_message = (payload.get('message') or "").strip()
             base64_image = payload.get('image')
             if base64_image:
-                # Accept data URLs like "data:image/png;base64,...." or plain base64 string
-                if ',' in base64_image:
-                    _, base64_data = base64_image.split(',', 1)
-                else:
-                    base64_data = base64_image
+                # Accept data URLs like "data:image/png;base64,...." or plain base64 string.
+                # The data URL header is short, so only its first bytes are searched for the comma.
+                comma = base64_image.find(',', 0, DATA_URL_HEADER_MAX_LENGTH)
+                base64_data = base64_image[comma + 1:] if comma != -1 else base64_image
+
+                # Reject oversized payloads from their encoded length before decoding
+                if _decoded_base64_length(base64_data) > MAX_UPLOAD_SIZE:
+                    return _json_body_response(TOO_LARGE_BODY, status=413)
 
                 try:
-                    binary = base64.b64decode(base64_data)
-                except Exception:
+                    binary = _b64decode(base64_data)
+                except Exception as e:
+                    logger.warning("Invalid base64 image data: %s", e)
                     return JsonResponse({'response': 'Invalid base64 image data.'}, status=400)
 
                 # Basic size check
                 if len(binary) > MAX_UPLOAD_SIZE:
-                    return JsonResponse({'response': f'Image too large (max {MAX_UPLOAD_SIZE // (1024*1024)}MB).'}, status=400)
+                    return _json_body_response(TOO_LARGE_BODY, status=413)
 
+                image_mime = _sniff_image(binary[:12])
+                if not image_mime:
+                    return JsonResponse({'response': 'Failed to decode image.'}, status=400)
+
+                # One buffer is shared by PIL and storage so the image is not copied again
+                image_buffer = io.BytesIO(binary)
+
+                # Parse the image before persisting it so corrupt files are never saved
                 try:
-                    pil_image = Image.open(io.BytesIO(binary))
-                except Exception:
+                    image_blob = await _prepare_image_blob(image_buffer, image_mime)
+                except Exception as e:
+                    logger.warning("Error processing uploaded image: %s", e)
                     return JsonResponse({'response': 'Failed to decode image.'}, status=400)
 
                 # Optionally save the binary to storage and get a URL
                 try:
-                    saved_path = default_storage.save('chat_uploads/uploaded_from_json.png', ContentFile(binary))
-                    image_url = default_storage.url(saved_path)
-                except Exception:
-                    logger.exception("Failed to save base64 image to storage; continuing without saved URL.")
+                    image_url = await sync_to_async(_save_image, thread_sensitive=False)(image_buffer, image_mime)
+                except Exception as e:
+                    logger.error("Failed to save base64 image to storage; continuing without saved URL: %s", e)
 
         # If nothing provided
-        if not user_message and not pil_image:
-            return JsonResponse({'response': 'Please send text or an image.'}, status=200)
+        if not user_message and not image_blob:
+            return _json_body_response(EMPTY_MESSAGE_BODY, status=200)
 
         # --- Prepare contents for Gemini chat ---
-        # The Gemini SDK's expected types for multimodal inputs may vary. In the original code
-        # you passed PIL.Image objects. We'll preserve that, passing a list composed of the
-        # text (if present) and the PIL image (if present). If Gemini expects bytes or file
-        # objects instead, adapt here accordingly.
+        # A list composed of the text (if present) and the image as an inline blob (if present).
         contents = []
         if user_message:
             contents.append(user_message)
-        if pil_image:
-            contents.append(pil_image)
-
-        # --- Send to Gemini and obtain response ---
-        try:
-            response = chat_session.send_message(contents)
-            # The SDK might return different shapes; try to read a text attribute or fallback
-            bot_reply = getattr(response, "text", None) or (response.get("text") if isinstance(response, dict) else None)
-            if not bot_reply:
-                # Last-resort: cast response to str
-                bot_reply = str(response)
-        except Exception as e:
-            logger.exception("Gemini API error while sending message: %s", e)
-            return JsonResponse({'response': 'Sorry, the AI assistant encountered an error. Please try again.'}, status=500)
+        if image_blob:
+            contents.append(image_blob)
+
+        # --- Send to Gemini (or reuse a cached reply) and obtain response ---
+        history = await request.session.aget(HISTORY_SESSION_KEY, [])
+        cache_key = _response_cache_key(user_message, image_blob['data'] if image_blob else b'', history)
+        bot_reply = await caches[RESPONSE_CACHE_ALIAS].aget(cache_key)
+        if bot_reply is not None:
+            # Record the cached turn so the session history matches what Gemini would have kept
+            history = history + [
+                _history_entry('user', [user_message] if user_message else []),
+                _history_entry('model', [bot_reply]),
+            ]
+            await request.session.aset(HISTORY_SESSION_KEY, history[-MAX_HISTORY_MESSAGES:])
+        else:
+            chat_session = model.start_chat(history=history)
+            try:
+                loop = asyncio.get_running_loop()
+                response = await loop.run_in_executor(GEMINI_EXECUTOR, chat_session.send_message, contents)
+                # The SDK might return different shapes; try to read a text attribute or fallback
+                bot_reply = getattr(response, "text", None) or (response.get("text") if isinstance(response, dict) else None)
+                if not bot_reply:
+                    # Last-resort: cast response to str
+                    bot_reply = str(response)
+            except Exception as e:
+                logger.error("Gemini API error while sending message: %s", e)
+                return JsonResponse({'response': 'Sorry, the AI assistant encountered an error. Please try again.'}, status=500)
+
+            await request.session.aset(HISTORY_SESSION_KEY, _serialize_history(chat_session.history))
+            await caches[RESPONSE_CACHE_ALIAS].aset(cache_key, bot_reply, timeout=RESPONSE_CACHE_TIMEOUT)
 
         # --- Return response (include image_url if we saved one) ---
         result = {'response': bot_reply}
         if image_url:
             result['image_url'] = image_url
 
-        return JsonResponse(result)
+        return _json_response(result)
 
     except Exception as exc:
         # Catch-all — don't expose internals to client